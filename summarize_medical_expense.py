@@ -1,14 +1,38 @@
 import os
+import re
 import csv
 import base64
+import hashlib
+import io
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
+from PIL import Image, ImageOps
 from tqdm import tqdm
 from collections import defaultdict
 
 API_KEY = os.getenv("OPENAI_API_KEY")
 
+# 使用するモデル
+MODEL = "gpt-4o-2024-11-20"
+# MODEL = "gpt-4o-mini" # 4o-miniでもそこそこ正しく読み取れている
+
+# OpenAI APIのエンドポイントとリクエストヘッダー
+API_URL = "https://api.openai.com/v1/chat/completions"
+API_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {API_KEY}"
+}
+
+# タイムアウト設定（接続, 読み込み）（秒）
+REQUEST_TIMEOUT = (10, 60)
+
+# 全リクエストで接続（TLSセッション）を再利用するためのHTTPセッション
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
+
 PROMPT = """
 この医療費領収書から以下の情報を抽出してください。
 1.患者氏名（正確に抽出してください。周囲に「氏名」や「様」と記載されている場合が多いです。）
@@ -28,6 +52,111 @@ PROMPT = """
 - JSONのフィールドは必ず指定された形式で出力してください。
 """
 
+# LLMの出力からJSON部分（```json ... ```）を取り出す正規表現
+JSON_FENCE_RE = re.compile(r"```json\s*(.*?)\s*```", re.DOTALL)
+
+# 名前の正規化に使う正規表現（空白、および末尾の敬称。「先生様」のように重なった敬称もまとめて削除する）
+WHITESPACE_RE = re.compile(r"[\s\u3000]+")
+HONORIFIC_RE = re.compile(r"(?:さん|様|殿|氏|先生)+$")
+
+# 金額の数値化の前に削除する文字（カンマ、円記号、半角・全角スペース）
+AMOUNT_STRIP_TABLE = str.maketrans("", "", ",円 　￥¥")
+
+# 処理対象とする画像ファイルの拡張子
+IMAGE_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"})
+
+# 画像の前処理の設定
+MAX_IMAGE_EDGE = 1536  # 縮小後の長辺の最大ピクセル数
+JPEG_QUALITY = 85  # 再圧縮時のJPEG品質
+PREPROCESS_MIN_BYTES = 300 * 1024  # このサイズ未満の画像は縮小・再圧縮しない
+IMAGE_DETAIL = "high"  # Vision APIの解像度指定（領収書の細かい文字を読むため high を使用）
+
+# キャッシュの設定
+CACHE_DIR = Path.home() / ".cache" / "medical_deduction"  # キャッシュの保存先（患者名や画像を含むため本人のみ読み書き可能にする）
+USE_CACHE = True  # Falseの場合はキャッシュを読み込まない（結果は上書き保存する）
+# 抽出結果のキャッシュキーに含める設定（モデル・プロンプト・画像の前処理が変わった場合は別のキャッシュを使う）
+RESULT_CACHE_VERSION = hashlib.sha256(
+    f"{MODEL}\n{PROMPT}\n{MAX_IMAGE_EDGE}\n{JPEG_QUALITY}\n{IMAGE_DETAIL}".encode("utf-8")
+).hexdigest()[:12]
+
+def cached_extract(image_path):
+    """
+    画像ファイル内容のSHA-256ハッシュをキーに、抽出結果をキャッシュしながら情報を抽出する
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        dict: 抽出された情報（患者名、医療機関名、支払金額）
+    """
+    with open(image_path, "rb") as f:
+        image_hash = hashlib.file_digest(f, "sha256").hexdigest()
+    cache_path = CACHE_DIR / f"{image_hash}_{RESULT_CACHE_VERSION}.json"
+    
+    # キャッシュがあればAPIを呼び出さずに返す
+    if USE_CACHE and cache_path.exists():
+        try:
+            return orjson.loads(cache_path.read_bytes())
+        except orjson.JSONDecodeError:
+            pass
+    
+    info = extract_info_from_image(image_path)
+    
+    # エラーやJSONを解析できなかった結果以外をキャッシュに保存
+    # （一時ファイルからの置き換えで書き込み途中の破損を防ぎ、ファイルは本人のみ読み書き可能にする）
+    if info["patient_name"] != "エラー" and not info.get("json_parse_failed"):
+        CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        os.chmod(CACHE_DIR, 0o700)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(info, ensure_ascii=False))
+        os.replace(tmp_path, cache_path)
+    
+    return info
+
+def preprocess_image(image_path):
+    """
+    送信データ量とトークン数を減らすため、画像を縮小してJPEGに再圧縮する
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        bytes: 送信する画像データ（小さい画像やPillowで読み込めない画像は元のデータのまま）
+    """
+    # 十分に小さい画像は縮小・再圧縮しない
+    if os.path.getsize(image_path) < PREPROCESS_MIN_BYTES:
+        with open(image_path, "rb") as image_file:
+            return image_file.read()
+    
+    try:
+        with Image.open(image_path) as img:
+            # スマートフォン写真の回転情報を反映してから縮小する
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buf.getvalue()
+    except OSError as e:
+        # Pillowで読み込めない画像は元のデータをそのまま送信する
+        print(f"画像の縮小に失敗したため元の画像を送信します ({image_path}): {e}")
+        with open(image_path, "rb") as image_file:
+            return image_file.read()
+
+def encode_image_as_data_uri(image_path):
+    """
+    画像をBase64エンコードしたdata URIを作成する
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        str: Base64エンコードされた画像のdata URI
+    """
+    # バイト列のままdata URIを組み立て、文字列への変換は最後に1回だけ行う
+    return (b"data:image/jpeg;base64," + base64.b64encode(preprocess_image(image_path))).decode("ascii")
+
 # マルチモーダルLLM APIを使って画像から情報を抽出する関数
 def extract_info_from_image(image_path):
     """
@@ -39,20 +168,13 @@ def extract_info_from_image(image_path):
     Returns:
         dict: 抽出された情報（患者名、医療機関名、支払金額）
     """
-    # 画像をBase64エンコード
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    # 画像を縮小してBase64エンコード
+    data_uri = encode_image_as_data_uri(image_path)
     
     # OpenAI Vision API用のリクエスト設定（例としてGPT-4 Visionを使用）
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
-    
     # プロンプトの作成（日本語で明確な指示を与える）
     payload = {
-        "model": "gpt-4o-2024-11-20",
-        # "model": "gpt-4o-mini", # 4o-miniでもそこそこ正しく読み取れている
+        "model": MODEL,
         "messages": [
             {
                 "role": "user",
@@ -64,7 +186,8 @@ def extract_info_from_image(image_path):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": data_uri,
+                            "detail": IMAGE_DETAIL
                         }
                     }
                 ]
@@ -75,35 +198,35 @@ def extract_info_from_image(image_path):
     
     # APIリクエストの送信
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
+        response = SESSION.post(
+            API_URL,
+            headers=API_HEADERS,
+            data=orjson.dumps(payload),
+            timeout=REQUEST_TIMEOUT
         )
         response.raise_for_status()  # エラーチェック
         
         # レスポンスから情報を抽出
-        result = response.json()
+        result = orjson.loads(response.content)
         # print("RESULT:", result)
         content = result["choices"][0]["message"]["content"]
         
         # JSONレスポンスを解析
         try:
             # JSONの部分を探す
-            import re
-            json_match = re.search(r"```json\n(.*?)\n```", content, re.DOTALL)
+            json_match = JSON_FENCE_RE.search(content)
             if json_match:
                 json_content = json_match.group(1)
             else:
                 json_content = content
                 
-            data = json.loads(json_content)
+            data = orjson.loads(json_content)
             return {
                 "patient_name": normalize_name(data.get("患者氏名", "不明")),
                 "hospital_name": normalize_name(data.get("医療機関名", "不明")),
                 "amount": data.get("支払った医療費の金額", "不明")
             }
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # JSON解析に失敗した場合は、テキスト解析を試みる
             print(f"JSON解析エラー: {content}")
             patient_name = "不明"
@@ -121,10 +244,13 @@ def extract_info_from_image(image_path):
             return {
                 "patient_name": normalize_name(patient_name),
                 "hospital_name": normalize_name(hospital_name),
-                "amount": amount
+                "amount": amount,
+                # JSONとして解析できなかった結果は再試行できるようキャッシュしない
+                "json_parse_failed": True
             }
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        # レスポンス本文がJSONでない場合（プロキシのエラーページなど）もエラーとして扱う
         print(f"APIリクエストエラー: {e}")
         return {
             "patient_name": "エラー",
@@ -145,16 +271,45 @@ def normalize_name(name):
     if not name:
         return "不明"
     
-    # 基本的な正規化：全角スペース、半角スペース、記号などを削除
-    normalized = name.replace("　", "").replace(" ", "").strip()
-    
-    # さん、様などの敬称を削除
-    honorifics = ["さん", "様", "殿", "氏", "先生"]
-    for honorific in honorifics:
-        if normalized.endswith(honorific):
-            normalized = normalized[:-len(honorific)]
+    # 基本的な正規化：全角スペース、半角スペース、タブ、改行などの空白を削除し、
+    # 末尾のさん、様などの敬称を削除
+    return HONORIFIC_RE.sub("", WHITESPACE_RE.sub("", name)) or "不明"
+
+def iter_consolidated(combined_data):
+    """
+    医療機関と受診者名でグループ化したデータから、集計CSVの行を1行ずつ生成する
     
-    return normalized
+    Args:
+        combined_data (dict): （医療機関名, 受診者名）のタプルをキー、領収書データのリストを値とする辞書
+        
+    Yields:
+        tuple: 集計CSVの1行（医療機関名、受診者名、区分、合計金額、領収書数、ファイル名一覧）
+    """
+    for (hospital_name, patient_name), receipts in combined_data.items():
+        # 金額の合計を計算
+        total_amount = 0
+        receipts_with_valid_amount = 0
+        
+        for receipt in receipts:
+            if isinstance(receipt["amount"], (int, float)):
+                total_amount += receipt["amount"]
+                receipts_with_valid_amount += 1
+        
+        # 日付別領収書ファイル一覧を作成
+        filenames = [r["filename"] for r in receipts]
+        
+        yield (
+            hospital_name,
+            patient_name,
+            "該当する",  # medical_cure
+            "",  # medicine
+            "",  # support
+            "",  # others
+            total_amount,
+            len(receipts),
+            receipts_with_valid_amount,
+            ", ".join(filenames)
+        )
 
 def process_receipts_in_folder(folder_path, output_csv_path):
     """
@@ -164,13 +319,12 @@ def process_receipts_in_folder(folder_path, output_csv_path):
         folder_path (str): 医療費領収書画像が格納されているフォルダのパス
         output_csv_path (str): 出力先CSVファイルのパス
     """
-    # 画像ファイルの拡張子リスト
-    image_extensions = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"]
-    
-    # フォルダ内の画像ファイルを取得
-    image_files = []
-    for ext in image_extensions:
-        image_files.extend(list(Path(folder_path).glob(f"*{ext}")))
+    # フォルダ内の画像ファイルを1回の走査で取得（拡張子の大文字・小文字は区別しない）
+    with os.scandir(folder_path) as entries:
+        image_files = [
+            Path(entry.path) for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        ]
     
     print(f"合計 {len(image_files)} 件の画像ファイルが見つかりました。")
     
@@ -182,12 +336,12 @@ def process_receipts_in_folder(folder_path, output_csv_path):
         print(f"処理中: {image_path.name}")
         
         # 画像から情報を抽出
-        info = extract_info_from_image(str(image_path))
+        info = cached_extract(str(image_path))
         
         # 金額を数値に変換（可能な場合）
         try:
             # カンマや円記号、スペースを削除して数値化
-            amount_str = str(info["amount"]).replace(",", "").replace("円", "").replace(" ", "").strip()
+            amount_str = str(info["amount"]).translate(AMOUNT_STRIP_TABLE).strip()
             amount_value = int(amount_str)
         except (ValueError, TypeError):
             # 数値に変換できない場合は元の値を使用
@@ -205,61 +359,24 @@ def process_receipts_in_folder(folder_path, output_csv_path):
     combined_data = defaultdict(list)
     
     for result in individual_results:
-        # キーとして「医療機関名_受診者名」を使用
-        key = f"{result["hospital_name"]}_{result["patient_name"]}"
-        combined_data[key].append(result)
-    
-    # グループごとにまとめた結果を生成
-    consolidated_results = []
-    
-    for key, receipts in combined_data.items():
-        # キーから医療機関名と受診者名を取得
-        hospital_name, patient_name = key.split("_", 1)
-        
-        # 金額の合計を計算
-        total_amount = 0
-        receipts_with_valid_amount = 0
-        
-        for receipt in receipts:
-            if isinstance(receipt["amount"], (int, float)):
-                total_amount += receipt["amount"]
-                receipts_with_valid_amount += 1
-        
-        # 日付別領収書ファイル一覧を作成
-        filenames = [r["filename"] for r in receipts]
-        
-        # 結果に追加
-        consolidated_results.append({
-            "hospital_name": hospital_name,
-            "patient_name": patient_name,
-            "medical_cure": "該当する",
-            "medicine": "",
-            "support": "",
-            "others": "",
-            "total_amount": total_amount,
-            "receipt_count": len(receipts),
-            "receipts_with_amount": receipts_with_valid_amount,
-            "filenames": ", ".join(filenames)
-        })
+        # キーとして（医療機関名, 受診者名）のタプルを使用
+        combined_data[(result["hospital_name"], result["patient_name"])].append(result)
     
     # 結果をCSVファイルに保存（医療機関と受診者名でまとめたバージョン）
     with open(output_csv_path, "w", newline="", encoding="utf-8-sig") as csvfile:
-        fieldnames = ["hospital_name", "patient_name", "medical_cure", "medicine", "support", "others", "total_amount", "receipt_count", "receipts_with_amount", "filenames"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for result in consolidated_results:
-            writer.writerow(result)
+        writer = csv.writer(csvfile)
+        writer.writerow(("hospital_name", "patient_name", "medical_cure", "medicine", "support", "others", "total_amount", "receipt_count", "receipts_with_amount", "filenames"))
+        writer.writerows(iter_consolidated(combined_data))
     
     # 元の詳細データも保存（デバッグや詳細確認用）
     detail_csv_path = output_csv_path.replace(".csv", "_detail.csv")
     with open(detail_csv_path, "w", newline="", encoding="utf-8-sig") as csvfile:
-        fieldnames = ["filename", "patient_name", "hospital_name", "amount"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for result in individual_results:
-            writer.writerow(result)
+        writer = csv.writer(csvfile)
+        writer.writerow(("filename", "patient_name", "hospital_name", "amount"))
+        writer.writerows(
+            (result["filename"], result["patient_name"], result["hospital_name"], result["amount"])
+            for result in individual_results
+        )
     
     print(f"処理が完了しました。")
     print(f"集計結果: {output_csv_path}")
@@ -269,6 +386,7 @@ def main():
     """
     メイン関数：コマンドライン引数を処理し、処理を実行する
     """
+    global USE_CACHE
     import argparse
     
     parser = argparse.ArgumentParser(description="医療費領収書画像から情報を抽出してCSVに出力するプログラム")
@@ -276,8 +394,14 @@ def main():
     parser.add_argument("--output", "-o", default="medical_receipts_data.csv", 
                         help="出力CSVファイルのパス（デフォルト: medical_receipts_data.csv）")
     
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"キャッシュを使用せずに全画像を再処理する（キャッシュ保存先: {CACHE_DIR}）")
+    
     args = parser.parse_args()
     
+    # キャッシュの使用有無を設定
+    USE_CACHE = not args.no_cache
+    
     # 処理の実行
     process_receipts_in_folder(args.folder_path, args.output)
 
@@ -1,16 +1,45 @@
 import os
+import re
 import csv
+import codecs
 import base64
+import hashlib
+import io
+import random
 from pathlib import Path
-import requests
 import json
-import time
+import orjson
+import asyncio
+import tempfile
+import aiohttp
+from aiolimiter import AsyncLimiter
+from PIL import Image, ImageOps
 from tqdm import tqdm
-from collections import defaultdict
-import concurrent.futures
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    # pyarrowが無い場合はcsvモジュールで集計・出力する
+    pa = None
 
 API_KEY = os.getenv("OPENAI_API_KEY")
 
+# 使用するモデル
+MODEL = "gpt-4o-2024-11-20"
+
+# OpenAI APIのエンドポイントとリクエストヘッダー
+# （Content-Typeはファイルアップロードと共用するため、リクエストごとにaiohttpが設定する）
+API_BASE_URL = "https://api.openai.com/v1"
+API_URL = f"{API_BASE_URL}/chat/completions"
+API_HEADERS = {
+    "Authorization": f"Bearer {API_KEY}"
+}
+JSON_HEADERS = {"Content-Type": "application/json"}  # シリアライズ済みのJSONを送信する際に追加するヘッダー
+
 PROMPT = """
 この医療費領収書から以下の情報を抽出してください。
 1.患者氏名（正確に抽出してください。周囲に「氏名」や「様」と記載されている場合が多いです。）
@@ -30,145 +59,645 @@ PROMPT = """
 - JSONのフィールドは必ず指定された形式で出力してください。
 """
 
-# バッチ処理の設定
-BATCH_SIZE = 10  # 一度に処理する画像の数
+# 並列処理の設定
+MAX_CONCURRENT = 50  # 同時に送信するAPIリクエストの最大数
+REQUESTS_PER_MINUTE = 500  # 1分あたりに送信するAPIリクエストの最大数（アカウントのRPM上限に合わせる）
 MAX_RETRIES = 3  # API呼び出しの最大リトライ回数
-RETRY_DELAY = 2  # リトライ間の待機時間（秒）
+RETRY_DELAY = 2  # リトライ間の待機時間の基準値（秒）。試行ごとに倍増する
+RETRY_MAX_DELAY = 60  # リトライ間の待機時間の上限（秒）
+REQUEST_TIMEOUT = 60  # バッチジョブの作成・状態確認リクエストのタイムアウト（秒）
+COMPLETION_TIMEOUT = 45  # 画像1枚の推論リクエスト1回あたりのタイムアウト（秒）。超過した場合はリトライする
+ENCODE_WINDOW = (os.cpu_count() or 1) * 2  # batchモードで同時に縮小・エンコード中とする画像の最大数（メモリ上に保持するdata URIの数を抑える）
+
+# Batch APIの設定
+BATCH_COMPLETION_WINDOW = "24h"  # バッチジョブの完了期限
+BATCH_POLL_INTERVAL = 30  # バッチジョブの状態確認間隔（秒）
+BATCH_MAX_REQUESTS = 50000  # 1つのバッチジョブに含められるリクエスト数の上限
+BATCH_MAX_BYTES = 200 * 1000 * 1000  # 1つのバッチジョブの入力ファイルサイズの上限（バイト）
+
+# LLMの出力からJSON部分（```json ... ```）を取り出す正規表現
+JSON_FENCE_RE = re.compile(r"```json\s*(.*?)\s*```", re.DOTALL)
+
+# 名前の正規化に使う正規表現（空白、および末尾の敬称。「先生様」のように重なった敬称もまとめて削除する）
+WHITESPACE_RE = re.compile(r"[\s\u3000]+")
+HONORIFIC_RE = re.compile(r"(?:さん|様|殿|氏|先生)+$")
+
+# 集計CSVの列名
+CONSOLIDATED_FIELDNAMES = ("hospital_name", "patient_name", "medical_cure", "medicine", "support", "others", "total_amount", "receipt_count", "receipts_with_amount", "filenames")
+
+# 金額の数値化の前に削除する文字（カンマ、円記号、半角・全角スペース）
+AMOUNT_STRIP_TABLE = str.maketrans("", "", ",円 　￥¥")
 
-def encode_image(image_path):
+# pyarrowで集計できる金額の絶対値の合計の上限（int64の最大値）
+ARROW_MAX_AMOUNT_TOTAL = 2**63 - 1
+
+# 処理対象とする画像ファイルの拡張子
+IMAGE_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"})
+
+# 画像の前処理の設定
+MAX_IMAGE_EDGE = 1536  # 縮小後の長辺の最大ピクセル数
+JPEG_QUALITY = 85  # 再圧縮時のJPEG品質
+PREPROCESS_MIN_BYTES = 300 * 1024  # このサイズ未満の画像は縮小・再圧縮しない
+IMAGE_DETAIL = "high"  # Vision APIの解像度指定（領収書の細かい文字を読むため high を使用）
+
+# キャッシュの設定
+CACHE_DIR = Path.home() / ".cache" / "medical_deduction"  # キャッシュの保存先（患者名や画像を含むため本人のみ読み書き可能にする）
+USE_CACHE = True  # Falseの場合はキャッシュを読み込まない（結果は上書き保存する）
+# 抽出結果のキャッシュキーに含める設定（モデル・プロンプト・画像の前処理が変わった場合は別のキャッシュを使う）
+RESULT_CACHE_VERSION = hashlib.sha256(
+    f"{MODEL}\n{PROMPT}\n{MAX_IMAGE_EDGE}\n{JPEG_QUALITY}\n{IMAGE_DETAIL}".encode("utf-8")
+).hexdigest()[:12]
+
+def file_sha256(image_path):
     """
-    画像をBase64エンコードする
+    ファイル内容のSHA-256ハッシュを計算する
     
     Args:
         image_path (str): 画像ファイルのパス
         
     Returns:
-        str: Base64エンコードされた画像データ
+        str: 16進数表記のハッシュ値
+    """
+    with open(image_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def read_cache(cache_name):
+    """
+    キャッシュファイルを読み込む
+    
+    Args:
+        cache_name (str): キャッシュファイル名
+        
+    Returns:
+        str: キャッシュの内容（キャッシュが無い場合や無効な場合はNone）
+    """
+    if not USE_CACHE:
+        return None
+    try:
+        return (CACHE_DIR / cache_name).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+def write_cache(cache_name, text):
+    """
+    キャッシュファイルを書き込む（一時ファイルからの置き換えで書き込み途中の破損を防ぐ）
+    
+    Args:
+        cache_name (str): キャッシュファイル名
+        text (str): 書き込む内容
     """
+    CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chmod(CACHE_DIR, 0o700)
+    cache_path = CACHE_DIR / cache_name
+    tmp_path = cache_path.with_name(f"{cache_name}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+
+def load_cached_result(image_hash):
+    """
+    キャッシュ済みの抽出結果を取得する
+    
+    Args:
+        image_hash (str): 画像ファイルのSHA-256ハッシュ
+        
+    Returns:
+        dict: 抽出された情報（キャッシュが無い場合はNone）
+    """
+    cached = read_cache(f"{image_hash}_{RESULT_CACHE_VERSION}.json")
+    if cached is None:
+        return None
+    try:
+        return orjson.loads(cached)
+    except orjson.JSONDecodeError:
+        return None
+
+def save_cached_result(image_hash, result):
+    """
+    抽出結果をキャッシュに保存する（エラー結果やJSONを解析できなかった結果は保存しない）
+    
+    Args:
+        image_hash (str): 画像ファイルのSHA-256ハッシュ
+        result (dict): 抽出された情報
+    """
+    if result["patient_name"] == "エラー" or result.get("json_parse_failed"):
+        return
+    data = {key: value for key, value in result.items() if key != "filename"}
+    write_cache(f"{image_hash}_{RESULT_CACHE_VERSION}.json", json.dumps(data, ensure_ascii=False))
+
+def preprocess_image(image_path):
+    """
+    送信データ量とトークン数を減らすため、画像を縮小してJPEGに再圧縮する
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        bytes: 縮小・再圧縮したJPEGデータ
+    """
+    with Image.open(image_path) as img:
+        # スマートフォン写真の回転情報を反映してから縮小する
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+def needs_preprocess(image_path):
+    """
+    画像の縮小・再圧縮が必要かどうかを判定する
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        bool: 縮小・再圧縮する場合はTrue（小さい画像は元のデータのまま送信する）
+    """
+    return os.path.getsize(image_path) >= PREPROCESS_MIN_BYTES
+
+def encode_image_base64(image_path):
+    """
+    画像をBase64エンコードする（大きい画像は縮小・再圧縮してからエンコードする）
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        
+    Returns:
+        bytes: Base64エンコードされた画像データ
+    """
+    if needs_preprocess(image_path):
+        try:
+            return base64.b64encode(preprocess_image(image_path))
+        except OSError as e:
+            # Pillowで読み込めない画像は元のデータをそのまま送信する
+            print(f"画像の縮小に失敗したため元の画像を送信します ({image_path}): {e}")
+    
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+        return base64.b64encode(image_file.read())
+
+def encode_image_as_data_uri(image_path, image_hash):
+    """
+    画像をBase64エンコードしたdata URIを作成する（縮小した画像はファイル内容のハッシュでキャッシュする）
+    
+    Args:
+        image_path (str): 画像ファイルのパス
+        image_hash (str): 画像ファイルのSHA-256ハッシュ（重複排除時に計算済みのもの）
+        
+    Returns:
+        str: Base64エンコードされた画像のdata URI
+    """
+    # 縮小しない小さい画像はそのままエンコードした方が速いため、キャッシュを使わない
+    if not needs_preprocess(image_path):
+        return (b"data:image/jpeg;base64," + encode_image_base64(image_path)).decode("ascii")
+    
+    # 縮小処理の設定が変わった場合に古いキャッシュを使わないよう、設定値をキーに含める
+    cache_name = f"{image_hash}_{MAX_IMAGE_EDGE}q{JPEG_QUALITY}.uri"
+    data_uri = read_cache(cache_name)
+    if data_uri is None:
+        # バイト列のままdata URIを組み立て、文字列への変換は最後に1回だけ行う
+        data_uri = (b"data:image/jpeg;base64," + encode_image_base64(image_path)).decode("ascii")
+        write_cache(cache_name, data_uri)
+    return data_uri
+
+def encode_images_as_data_uris(pool, image_paths, image_hashes):
+    """
+    複数の画像のdata URIを入力順に作成する（縮小が必要な画像のみ別プロセスで並列に処理する）
+    
+    Args:
+        pool (ProcessPoolExecutor): 縮小・エンコードに使用するプロセスプール
+        image_paths (list): 画像ファイルパスのリスト
+        image_hashes (list): 各画像ファイルのSHA-256ハッシュのリスト
+        
+    Yields:
+        str: Base64エンコードされた画像のdata URI
+    """
+    # 先行して投入するのは一定数までとし、受け取ったdata URIは次の画像に進む前に解放されるようにする
+    in_flight = deque()
+    for image_path, image_hash in zip(image_paths, image_hashes):
+        if needs_preprocess(image_path):
+            in_flight.append(pool.submit(encode_image_as_data_uri, image_path, image_hash))
+        else:
+            in_flight.append((image_path, image_hash))
+        while len(in_flight) >= ENCODE_WINDOW:
+            item = in_flight.popleft()
+            yield encode_image_as_data_uri(*item) if isinstance(item, tuple) else item.result()
+    while in_flight:
+        item = in_flight.popleft()
+        yield encode_image_as_data_uri(*item) if isinstance(item, tuple) else item.result()
+
+def init_encode_worker(use_cache):
+    """
+    エンコード用ワーカープロセスの初期化（spawn方式でもキャッシュ設定を引き継ぐ）
+    
+    Args:
+        use_cache (bool): キャッシュを読み込むかどうか
+    """
+    global USE_CACHE
+    USE_CACHE = use_cache
 
-def batch_extract_info_from_images(image_paths):
+def build_request_data(data_uri):
     """
-    バッチ処理：複数の画像を一度にAPIに送信して情報を抽出する
+    1枚の画像に対するChat Completions APIのリクエストデータを作成する
     
     Args:
+        data_uri (str): Base64エンコードされた画像のdata URI
+        
+    Returns:
+        dict: APIリクエストデータ
+    """
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": data_uri,
+                            "detail": IMAGE_DETAIL
+                        }
+                    }
+                ]
+            }
+        ],
+        "max_tokens": 500
+    }
+
+async def batch_extract_info_from_images(session, image_paths, image_hashes, sem, limiter):
+    """
+    並列処理：複数の画像を同時にAPIに送信して情報を抽出する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
         image_paths (list): 画像ファイルパスのリスト
+        image_hashes (list): 各画像ファイルのSHA-256ハッシュのリスト
+        sem (asyncio.Semaphore): 同時リクエスト数を制限するセマフォ
+        limiter (AsyncLimiter): 1分あたりのリクエスト数を制限するリミッター
         
     Returns:
         list: 各画像から抽出された情報のリスト
     """
-    # OpenAI API用のヘッダー
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
+    loop = asyncio.get_running_loop()
+    # エンコード済みで送信待ちの画像数を制限し、メモリ使用量を抑える
+    pending = asyncio.Semaphore(MAX_CONCURRENT * 2)
     
-    # バッチ処理用のリクエストを準備
-    batch_requests = []
-    
-    # 各画像をBase64エンコードしてバッチリクエストを作成
-    for image_path in image_paths:
-        base64_image = encode_image(image_path)
-        
-        # 個別のリクエスト情報を作成
-        request_data = {
-            "model": "gpt-4o-2024-11-20",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": PROMPT
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 500
-        }
-        batch_requests.append(request_data)
+    async def extract(pool, image_path, image_hash, request_index):
+        async with pending:
+            if needs_preprocess(image_path):
+                # 画像の縮小・エンコードは別プロセスで行い、他の画像の送信と並行させる
+                data_uri = await loop.run_in_executor(pool, encode_image_as_data_uri, image_path, image_hash)
+            else:
+                data_uri = encode_image_as_data_uri(image_path, image_hash)
+            request_data = build_request_data(data_uri)
+            response_data = await send_api_request(session, request_data, sem, limiter, request_index)
+        return parse_api_response(response_data, image_path)
+    
+    # 全画像のリクエストをイベントループ上で並列に実行
+    with ProcessPoolExecutor(initializer=init_encode_worker, initargs=(USE_CACHE,)) as pool:
+        tasks = [
+            extract(pool, image_path, image_hash, i)
+            for i, (image_path, image_hash) in enumerate(zip(image_paths, image_hashes))
+        ]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
     
-    # 並列処理でAPIリクエストを送信
+    # 結果を取得
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(BATCH_SIZE, 5)) as executor:
-        # 各リクエストを並列に実行
-        future_to_path = {
-            executor.submit(send_api_request, request, headers, i): image_paths[i] 
-            for i, request in enumerate(batch_requests)
-        }
-        
-        # 結果を取得
-        for future in concurrent.futures.as_completed(future_to_path):
-            image_path = future_to_path[future]
-            try:
-                response_data = future.result()
-                
-                # レスポンスから情報を抽出
-                parsed_data = parse_api_response(response_data, image_path)
-                results.append(parsed_data)
-            except Exception as e:
-                print(f"エラー発生 ({image_path}): {e}")
-                # エラーの場合はデフォルト値を設定
-                results.append({
-                    "filename": Path(image_path).name,
-                    "patient_name": "エラー",
-                    "hospital_name": "エラー",
-                    "amount": "エラー"
-                })
+    for image_path, response in zip(image_paths, responses):
+        if isinstance(response, Exception):
+            print(f"エラー発生 ({image_path}): {response}")
+            # エラーの場合はデフォルト値を設定
+            results.append({
+                "filename": Path(image_path).name,
+                "patient_name": "エラー",
+                "hospital_name": "エラー",
+                "amount": "エラー"
+            })
+        else:
+            results.append(response)
     
     return results
 
-def send_api_request(request_data, headers, request_index):
+def format_api_error(e):
+    """
+    ログ出力用にAPIエラーの内容を文字列化する
+    （reprにはAuthorizationヘッダーを含むリクエスト情報が入るため使用しない）
+    
+    Args:
+        e (Exception): API呼び出しで発生した例外
+        
+    Returns:
+        str: エラー内容
+    """
+    if isinstance(e, aiohttp.ClientResponseError):
+        return f"ステータス {e.status} {e.message}"
+    return f"{type(e).__name__}: {e}"
+
+def backoff_delay(attempt):
+    """
+    リトライまでの待機時間を計算する（ジッター付きの指数バックオフ）
+    
+    Args:
+        attempt (int): 失敗した試行の番号（0始まり）
+        
+    Returns:
+        float: 待機時間（秒）
+    """
+    # 複数リクエストが同時にリトライしないよう、待機時間にランダムな揺らぎを加える
+    return min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt) + random.uniform(0, RETRY_DELAY)
+
+def parse_retry_after(value):
+    """
+    Retry-Afterヘッダーの値（秒数）を解析する
+    
+    Args:
+        value (str): Retry-Afterヘッダーの値
+        
+    Returns:
+        float: 待機時間（秒）。ヘッダーが無い・解析できない場合はNone
+    """
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+async def post_chat_completion(session, body):
+    """
+    Chat Completions APIにリクエストを1回送信する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        body (bytes): シリアライズ済みのAPIリクエストデータ
+        
+    Returns:
+        dict: APIレスポンス
+    """
+    async with session.post(API_URL, data=body, headers=JSON_HEADERS) as response:
+        response.raise_for_status()
+        return orjson.loads(await response.read())
+
+async def send_api_request(session, request_data, sem, limiter, request_index):
     """
     APIリクエストを送信し、リトライロジックを実装
     
     Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
         request_data (dict): APIリクエストデータ
-        headers (dict): APIリクエストヘッダー
+        sem (asyncio.Semaphore): 同時リクエスト数を制限するセマフォ
+        limiter (AsyncLimiter): 1分あたりのリクエスト数を制限するリミッター
         request_index (int): リクエストのインデックス（ログ用）
         
     Returns:
         dict: APIレスポンス
     """
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=request_data,
-                timeout=60  # タイムアウト設定
-            )
-            response.raise_for_status()
-            return response.json()
-        
-        except requests.exceptions.RequestException as e:
-            # リトライ可能なエラーの場合
-            print(f"リクエスト {request_index} 失敗 (試行 {attempt+1}/{MAX_RETRIES}): {e}")
+    # リトライのたびに数MBのBase64文字列を再シリアライズしないよう、送信前に一度だけ変換する
+    body = orjson.dumps(request_data)
+    
+    async with sem:
+        for attempt in range(MAX_RETRIES):
+            try:
+                # リクエストを一斉に送らず、1分あたりの上限に収まるよう一定のペースで送信する
+                await limiter.acquire()
+                # 応答の遅いリクエストに全体が引きずられないよう、期限を過ぎたら打ち切ってリトライする
+                return await asyncio.wait_for(post_chat_completion(session, body), timeout=COMPLETION_TIMEOUT)
             
-            # 最後の試行でなければリトライ
-            if attempt < MAX_RETRIES - 1:
-                # レート制限エラーの場合は長めに待機
-                if response.status_code == 429:
-                    retry_after = int(response.headers.get('Retry-After', RETRY_DELAY * 2))
-                    print(f"レート制限に達しました。{retry_after}秒待機します...")
-                    time.sleep(retry_after)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # 429・5xx以外のHTTPエラー（リクエスト内容の誤りなど）はリトライしない
+                status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+                if status is not None and status != 429 and status < 500:
+                    raise Exception(f"APIリクエスト失敗: {format_api_error(e)}")
+                
+                # リトライ可能なエラーの場合
+                print(f"リクエスト {request_index} 失敗 (試行 {attempt+1}/{MAX_RETRIES}): {format_api_error(e)}")
+                
+                # 最後の試行でなければリトライ
+                if attempt < MAX_RETRIES - 1:
+                    retry_after = None
+                    if status == 429:
+                        # レート制限エラーの場合はRetry-Afterヘッダーの指定に従う
+                        retry_after = parse_retry_after((e.headers or {}).get("Retry-After"))
+                    delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                    print(f"{delay:.1f}秒待機してリトライします...")
+                    await asyncio.sleep(delay)
                 else:
-                    # 通常のリトライ
-                    time.sleep(RETRY_DELAY)
-            else:
-                # 最大リトライ回数に達した場合は例外を発生
-                raise Exception(f"APIリクエスト失敗 (最大リトライ回数到達): {e}")
+                    # 最大リトライ回数に達した場合は例外を発生
+                    raise Exception(f"APIリクエスト失敗 (最大リトライ回数到達): {format_api_error(e)}")
     
     # ここには到達しないはずだが、念のため
     raise Exception("APIリクエスト失敗")
 
+async def submit_batch(session, input_path):
+    """
+    Batch API用のJSONLファイルをアップロードし、バッチジョブを作成する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        input_path (Path): アップロードするJSONLファイルのパス
+        
+    Returns:
+        str: 作成されたバッチジョブのID
+    """
+    # JSONLファイルをアップロード
+    with open(input_path, "rb") as f:
+        form = aiohttp.FormData()
+        form.add_field("purpose", "batch")
+        form.add_field("file", f, filename=input_path.name)
+        async with session.post(
+            f"{API_BASE_URL}/files",
+            data=form,
+            timeout=aiohttp.ClientTimeout(total=None)
+        ) as response:
+            response.raise_for_status()
+            input_file_id = orjson.loads(await response.read())["id"]
+    
+    # バッチジョブを作成
+    async with session.post(
+        f"{API_BASE_URL}/batches",
+        json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": BATCH_COMPLETION_WINDOW
+        },
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        batch = orjson.loads(await response.read())
+    
+    print(f"バッチジョブを作成しました: {batch['id']}")
+    return batch["id"]
+
+async def submit_batches(session, image_paths, image_hashes):
+    """
+    全画像のリクエストをJSONLファイルに書き出し、Batch APIの入力上限ごとに分割してバッチジョブを作成する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        image_paths (list): 画像ファイルパスのリスト
+        image_hashes (list): 各画像ファイルのSHA-256ハッシュのリスト（custom_idとして使用）
+        
+    Returns:
+        list: 作成されたバッチジョブのIDのリスト
+    """
+    batch_ids = []
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            ProcessPoolExecutor(initializer=init_encode_worker, initargs=(USE_CACHE,)) as pool:
+        f = None
+        input_path = None
+        request_count = 0
+        input_size = 0
+        try:
+            # 画像の縮小・エンコードは複数プロセスで並列に行う
+            data_uris = encode_images_as_data_uris(pool, image_paths, image_hashes)
+            for image_path, image_hash, data_uri in zip(image_paths, image_hashes, data_uris):
+                # 1画像につき1行のリクエストを作成（再開時にも対応付けられるよう、custom_idはハッシュとする）
+                line = orjson.dumps({
+                    "custom_id": image_hash,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": build_request_data(data_uri)
+                }, option=orjson.OPT_APPEND_NEWLINE)
+                if len(line) > BATCH_MAX_BYTES:
+                    print(f"エラー発生 ({image_path}): 画像が大きすぎるためBatch APIに送信できません")
+                    continue
+                
+                # 入力上限（リクエスト数・ファイルサイズ）を超える場合は、それまでの分を1つのバッチとして送信する
+                if f is not None and (request_count >= BATCH_MAX_REQUESTS or input_size + len(line) > BATCH_MAX_BYTES):
+                    f.close()
+                    f = None
+                    batch_ids.append(await submit_batch(session, input_path))
+                
+                if f is None:
+                    input_path = Path(tmp_dir) / f"batch_input_{len(batch_ids) + 1}.jsonl"
+                    f = open(input_path, "wb")
+                    request_count = 0
+                    input_size = 0
+                
+                f.write(line)
+                request_count += 1
+                input_size += len(line)
+            
+            if f is not None:
+                f.close()
+                f = None
+                batch_ids.append(await submit_batch(session, input_path))
+        finally:
+            if f is not None:
+                f.close()
+    
+    if batch_ids:
+        print(f"処理が中断された場合は、--batch-id {' --batch-id '.join(batch_ids)} を指定して再実行すると結果を取得できます。")
+    return batch_ids
+
+async def wait_for_batch(session, batch_id):
+    """
+    バッチジョブが終了するまで状態を定期的に確認する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        batch_id (str): バッチジョブのID
+        
+    Returns:
+        dict: 終了したバッチジョブの情報
+    """
+    while True:
+        async with session.get(
+            f"{API_BASE_URL}/batches/{batch_id}",
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            batch = orjson.loads(await response.read())
+        
+        status = batch["status"]
+        counts = batch.get("request_counts") or {}
+        print(f"バッチ状態 ({batch_id}): {status} ({counts.get('completed', 0)}/{counts.get('total', 0)} 件完了)")
+        
+        if status == "completed":
+            return batch
+        if status in ("failed", "expired", "cancelled"):
+            # 期限切れ・キャンセルの場合も完了済みの分は出力ファイルから取得できる
+            print(f"バッチジョブが完了しませんでした ({batch_id}, 状態: {status}): {batch.get('errors')}")
+            return batch
+        
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+
+async def download_batch_output(session, batch):
+    """
+    バッチジョブの出力ファイルをダウンロードし、custom_idごとのAPIレスポンスを取得する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        batch (dict): 終了したバッチジョブの情報
+        
+    Returns:
+        dict: custom_idをキー、APIレスポンスを値とする辞書
+    """
+    # 全件失敗した場合は出力ファイルが存在しない
+    responses = {}
+    if not batch.get("output_file_id"):
+        return responses
+    
+    async with session.get(
+        f"{API_BASE_URL}/files/{batch['output_file_id']}/content",
+        timeout=aiohttp.ClientTimeout(total=None)
+    ) as response:
+        response.raise_for_status()
+        output = await response.read()
+    
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        response_body = (item.get("response") or {}).get("body")
+        if response_body and item["response"].get("status_code") == 200:
+            responses[item["custom_id"]] = response_body
+        else:
+            print(f"エラー発生 ({item['custom_id']}): {item.get('error') or response_body}")
+    
+    return responses
+
+async def run_batch(session, image_paths, image_hashes, batch_ids=None):
+    """
+    Batch API：全画像をバッチジョブとして送信し、結果を取得して情報を抽出する
+    
+    Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
+        image_paths (list): 画像ファイルパスのリスト
+        image_hashes (list): 各画像ファイルのSHA-256ハッシュのリスト
+        batch_ids (list): 作成済みのバッチジョブのIDのリスト（指定した場合は送信せずに結果のみ取得する）
+        
+    Returns:
+        list: 各画像から抽出された情報のリスト
+    """
+    if not batch_ids:
+        batch_ids = await submit_batches(session, image_paths, image_hashes)
+    
+    responses = {}
+    for batch_id in batch_ids:
+        batch = await wait_for_batch(session, batch_id)
+        responses.update(await download_batch_output(session, batch))
+    
+    # 入力順に結果を並べる
+    results = []
+    for image_path, image_hash in zip(image_paths, image_hashes):
+        response_data = responses.get(image_hash)
+        if response_data is None:
+            # エラーの場合はデフォルト値を設定
+            results.append({
+                "filename": Path(image_path).name,
+                "patient_name": "エラー",
+                "hospital_name": "エラー",
+                "amount": "エラー"
+            })
+        else:
+            results.append(parse_api_response(response_data, image_path))
+    
+    return results
+
 def parse_api_response(result, image_path):
     """
     APIレスポンスを解析して必要な情報を抽出する
@@ -186,21 +715,20 @@ def parse_api_response(result, image_path):
         # JSONレスポンスを解析
         try:
             # JSONの部分を探す
-            import re
-            json_match = re.search(r"```json\n(.*?)\n```", content, re.DOTALL)
+            json_match = JSON_FENCE_RE.search(content)
             if json_match:
                 json_content = json_match.group(1)
             else:
                 json_content = content
                 
-            data = json.loads(json_content)
+            data = orjson.loads(json_content)
             return {
                 "filename": Path(image_path).name,
                 "patient_name": normalize_name(data.get("患者氏名", "不明")),
                 "hospital_name": normalize_name(data.get("医療機関名", "不明")),
                 "amount": data.get("支払った医療費の金額", "不明")
             }
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # JSON解析に失敗した場合は、テキスト解析を試みる
             print(f"JSON解析エラー: {content}")
             patient_name = "不明"
@@ -219,7 +747,9 @@ def parse_api_response(result, image_path):
                 "filename": Path(image_path).name,
                 "patient_name": normalize_name(patient_name),
                 "hospital_name": normalize_name(hospital_name),
-                "amount": amount
+                "amount": amount,
+                # JSONとして解析できなかった結果は再試行できるようキャッシュしない
+                "json_parse_failed": True
             }
             
     except Exception as e:
@@ -244,147 +774,261 @@ def normalize_name(name):
     if not name:
         return "不明"
     
-    # 基本的な正規化：全角スペース、半角スペース、記号などを削除
-    normalized = name.replace("　", "").replace(" ", "").strip()
+    # 基本的な正規化：全角スペース、半角スペース、タブ、改行などの空白を削除し、
+    # 末尾のさん、様などの敬称を削除
+    return HONORIFIC_RE.sub("", WHITESPACE_RE.sub("", name)) or "不明"
+
+def iter_consolidated(combined_data):
+    """
+    医療機関と受診者名でグループ化したデータから、集計CSVの行を1行ずつ生成する
     
-    # さん、様などの敬称を削除
-    honorifics = ["さん", "様", "殿", "氏", "先生"]
-    for honorific in honorifics:
-        if normalized.endswith(honorific):
-            normalized = normalized[:-len(honorific)]
+    Args:
+        combined_data (dict): （医療機関名, 受診者名）のタプルをキー、領収書データのリストを値とする辞書
+        
+    Yields:
+        tuple: 集計CSVの1行（医療機関名、受診者名、区分、合計金額、領収書数、ファイル名一覧）
+    """
+    for (hospital_name, patient_name), receipts in combined_data.items():
+        # 金額の合計を計算
+        total_amount = 0
+        receipts_with_valid_amount = 0
+        
+        for receipt in receipts:
+            if isinstance(receipt["amount"], (int, float)):
+                total_amount += receipt["amount"]
+                receipts_with_valid_amount += 1
+        
+        # 日付別領収書ファイル一覧を作成
+        filenames = [r["filename"] for r in receipts]
+        
+        yield (
+            hospital_name,
+            patient_name,
+            "該当する",  # medical_cure
+            "",  # medicine
+            "",  # support
+            "",  # others
+            total_amount,
+            len(receipts),
+            receipts_with_valid_amount,
+            ", ".join(filenames)
+        )
+
+def write_consolidated_csv_arrow(individual_results, output_csv_path):
+    """
+    pyarrowの列形式テーブルで医療機関と受診者名ごとに集計し、集計CSVファイルに出力する
+    
+    Args:
+        individual_results (list): 各領収書から抽出された情報のリスト
+        output_csv_path (str): 出力先CSVファイルのパス
+    """
+    # 領収書データを列ごとのリストに詰め替える（数値化できなかった金額は欠損値とする）
+    hospital_names = []
+    patient_names = []
+    amounts = []
+    filenames = []
+    for result in individual_results:
+        hospital_names.append(result["hospital_name"])
+        patient_names.append(result["patient_name"])
+        amounts.append(result["amount"] if isinstance(result["amount"], (int, float)) else None)
+        filenames.append(result["filename"])
+    
+    amount_array = pa.array(amounts)
+    if pa.types.is_null(amount_array.type):
+        amount_array = amount_array.cast(pa.int64())
+    
+    table = pa.table({
+        "hospital_name": pa.array(hospital_names, pa.string()),
+        "patient_name": pa.array(patient_names, pa.string()),
+        "amount": amount_array,
+        "filename": pa.array(filenames, pa.string())
+    })
     
-    return normalized
+    # シングルスレッドで集計し、グループとファイル名の並びを入力順に保つ
+    grouped = table.group_by(["hospital_name", "patient_name"], use_threads=False).aggregate([
+        ("amount", "sum"),
+        ("amount", "count"),
+        ("filename", "count"),
+        ("filename", "list")
+    ])
+    
+    row_count = grouped.num_rows
+    consolidated = pa.table({
+        "hospital_name": grouped["hospital_name"],
+        "patient_name": grouped["patient_name"],
+        "medical_cure": pa.array(["該当する"] * row_count, pa.string()),
+        "medicine": pa.array([""] * row_count, pa.string()),
+        "support": pa.array([""] * row_count, pa.string()),
+        "others": pa.array([""] * row_count, pa.string()),
+        "total_amount": pc.fill_null(grouped["amount_sum"], 0),
+        "receipt_count": grouped["filename_count"],
+        "receipts_with_amount": grouped["amount_count"],
+        "filenames": pc.binary_join(grouped["filename_list"], ", ")
+    })
+    
+    # Excelで文字化けしないよう、csvモジュール版と同じくBOM付きUTF-8で出力する
+    with open(output_csv_path, "wb") as csvfile:
+        csvfile.write(codecs.BOM_UTF8)
+        pa_csv.write_csv(consolidated, csvfile)
 
-def process_receipts_in_folder(folder_path, output_csv_path):
+async def process_receipts_in_folder(session, folder_path, output_csv_path, mode="live", batch_ids=None):
     """
-    指定フォルダ内の全ての医療費領収書画像をバッチ処理し、
+    指定フォルダ内の全ての医療費領収書画像を並列処理し、
     医療機関と受診者名でまとめた結果をCSVファイルに出力する
     
     Args:
+        session (aiohttp.ClientSession): API呼び出しに使用するセッション
         folder_path (str): 医療費領収書画像が格納されているフォルダのパス
         output_csv_path (str): 出力先CSVファイルのパス
+        mode (str): "live"（Chat Completions APIを直接呼び出す）または "batch"（Batch APIを使用する）
+        batch_ids (list): 作成済みのバッチジョブのIDのリスト（batchモードで中断した処理を再開する場合に指定）
     """
-    # 画像ファイルの拡張子リスト
-    image_extensions = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"]
-    
-    # フォルダ内の画像ファイルを取得
-    image_files = []
-    for ext in image_extensions:
-        image_files.extend(list(Path(folder_path).glob(f"*{ext}")))
+    # フォルダ内の画像ファイルを1回の走査で取得（拡張子の大文字・小文字は区別しない）
+    with os.scandir(folder_path) as entries:
+        image_files = [
+            Path(entry.path) for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        ]
     
     print(f"合計 {len(image_files)} 件の画像ファイルが見つかりました。")
     
-    # 結果格納用リスト
-    individual_results = []
+    # 内容が同一の画像をまとめ、APIには重複を除いた画像のみを送信する
+    hash_to_paths = defaultdict(list)
+    for path in image_files:
+        hash_to_paths[file_sha256(path)].append(str(path))
     
-    # バッチ処理のためのチャンク分割
-    for i in range(0, len(image_files), BATCH_SIZE):
-        batch = image_files[i:i+BATCH_SIZE]
-        batch_paths = [str(path) for path in batch]
-        
-        print(f"バッチ処理中: {i+1}〜{min(i+BATCH_SIZE, len(image_files))} / {len(image_files)}")
-        
-        # バッチ処理で情報を抽出
-        batch_results = batch_extract_info_from_images(batch_paths)
-        
-        # 結果を追加
-        individual_results.extend(batch_results)
+    # キャッシュ済みの結果を取得し、未処理の画像のみAPIに送信する
+    results_by_hash = {}
+    for image_hash in hash_to_paths:
+        cached = load_cached_result(image_hash)
+        if cached is not None:
+            results_by_hash[image_hash] = cached
+    pending_hashes = [image_hash for image_hash in hash_to_paths if image_hash not in results_by_hash]
+    image_paths = [hash_to_paths[image_hash][0] for image_hash in pending_hashes]
+    
+    print(f"重複を除いた画像: {len(hash_to_paths)} 件 / キャッシュ済み: {len(results_by_hash)} 件 / API送信: {len(image_paths)} 件")
+    
+    api_results = []
+    if image_paths and mode == "batch":
+        # Batch APIで一括処理（非同期ジョブの完了を待機）
+        api_results = await run_batch(session, image_paths, pending_hashes, batch_ids)
+    elif image_paths:
+        # 同時リクエスト数と1分あたりのリクエスト数を制限しながら逐次APIを呼び出す
+        sem = asyncio.Semaphore(MAX_CONCURRENT)
+        # バケット容量を1にして、起動直後もまとめて送信せず等間隔に送信する
+        limiter = AsyncLimiter(1, 60 / REQUESTS_PER_MINUTE)
+        api_results = await batch_extract_info_from_images(session, image_paths, pending_hashes, sem, limiter)
+    
+    # 新たに取得した結果をキャッシュに保存
+    for image_hash, result in zip(pending_hashes, api_results):
+        save_cached_result(image_hash, result)
+        results_by_hash[image_hash] = result
+    
+    # 同一内容の全ファイルに結果を展開
+    individual_results = []
+    for image_hash, paths in hash_to_paths.items():
+        for image_path in paths:
+            individual_results.append({**results_by_hash[image_hash], "filename": Path(image_path).name})
     
     # 金額を数値に変換
     for result in individual_results:
         try:
             # カンマや円記号、スペースを削除して数値化
-            amount_str = str(result["amount"]).replace(",", "").replace("円", "").replace(" ", "").strip()
+            amount_str = str(result["amount"]).translate(AMOUNT_STRIP_TABLE).strip()
             result["amount"] = int(amount_str)
         except (ValueError, TypeError):
             # 数値に変換できない場合は元の値を使用
             pass
     
-    # 医療機関名と受診者名の組み合わせでデータをグループ化
-    combined_data = defaultdict(list)
-    
-    for result in individual_results:
-        # キーとして「医療機関名_受診者名」を使用
-        key = f"{result['hospital_name']}_{result['patient_name']}"
-        combined_data[key].append(result)
-    
-    # グループごとにまとめた結果を生成
-    consolidated_results = []
-    
-    for key, receipts in combined_data.items():
-        # キーから医療機関名と受診者名を取得
-        hospital_name, patient_name = key.split("_", 1)
-        
-        # 金額の合計を計算
-        total_amount = 0
-        receipts_with_valid_amount = 0
+    # 金額の合計がpyarrowの整数列（int64）に収まらない場合（領収書番号などを金額として抽出した場合など）は、
+    # 変換エラーや合計のオーバーフローを避けるためcsvモジュールで集計する
+    amount_total = sum(abs(result["amount"]) for result in individual_results if isinstance(result["amount"], (int, float)))
+    if pa is not None and amount_total <= ARROW_MAX_AMOUNT_TOTAL:
+        # pyarrowが利用可能な場合は列形式で集計・出力する
+        write_consolidated_csv_arrow(individual_results, output_csv_path)
+    else:
+        # 医療機関名と受診者名の組み合わせでデータをグループ化
+        combined_data = defaultdict(list)
         
-        for receipt in receipts:
-            if isinstance(receipt["amount"], (int, float)):
-                total_amount += receipt["amount"]
-                receipts_with_valid_amount += 1
-        
-        # 日付別領収書ファイル一覧を作成
-        filenames = [r["filename"] for r in receipts]
+        for result in individual_results:
+            # キーとして（医療機関名, 受診者名）のタプルを使用
+            combined_data[(result["hospital_name"], result["patient_name"])].append(result)
         
-        # 結果に追加
-        consolidated_results.append({
-            "hospital_name": hospital_name,
-            "patient_name": patient_name,
-            "medical_cure": "該当する",
-            "medicine": "",
-            "support": "",
-            "others": "",
-            "total_amount": total_amount,
-            "receipt_count": len(receipts),
-            "receipts_with_amount": receipts_with_valid_amount,
-            "filenames": ", ".join(filenames)
-        })
-    
-    # 結果をCSVファイルに保存（医療機関と受診者名でまとめたバージョン）
-    with open(output_csv_path, "w", newline="", encoding="utf-8-sig") as csvfile:
-        fieldnames = ["hospital_name", "patient_name", "medical_cure", "medicine", "support", "others", "total_amount", "receipt_count", "receipts_with_amount", "filenames"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for result in consolidated_results:
-            writer.writerow(result)
+        # 結果をCSVファイルに保存（医療機関と受診者名でまとめたバージョン）
+        with open(output_csv_path, "w", newline="", encoding="utf-8-sig") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(CONSOLIDATED_FIELDNAMES)
+            writer.writerows(iter_consolidated(combined_data))
     
     # 元の詳細データも保存（デバッグや詳細確認用）
     detail_csv_path = output_csv_path.replace(".csv", "_detail.csv")
     with open(detail_csv_path, "w", newline="", encoding="utf-8-sig") as csvfile:
-        fieldnames = ["filename", "patient_name", "hospital_name", "amount"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for result in individual_results:
-            writer.writerow(result)
+        writer = csv.writer(csvfile)
+        writer.writerow(("filename", "patient_name", "hospital_name", "amount"))
+        writer.writerows(
+            (result["filename"], result["patient_name"], result["hospital_name"], result["amount"])
+            for result in individual_results
+        )
     
     print(f"処理が完了しました。")
     print(f"集計結果: {output_csv_path}")
     print(f"詳細データ: {detail_csv_path}")
 
+async def main_async(args):
+    """
+    非同期メイン関数：イベントループ上で処理を実行する
+    
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+    """
+    # 実行全体で1つのセッションを使い回し、接続（TLSセッション）を再利用する
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT)
+    async with aiohttp.ClientSession(headers=API_HEADERS, connector=connector) as session:
+        await process_receipts_in_folder(session, args.folder_path, args.output, args.mode, args.batch_ids)
+
 def main():
     """
     メイン関数：コマンドライン引数を処理し、処理を実行する
     """
+    global MAX_CONCURRENT, REQUESTS_PER_MINUTE, USE_CACHE
     import argparse
     
     parser = argparse.ArgumentParser(description="医療費領収書画像から情報を抽出してCSVに出力するプログラム")
     parser.add_argument("folder_path", help="医療費領収書画像が格納されているフォルダのパス")
     parser.add_argument("--output", "-o", default="medical_receipts_data.csv", 
                         help="出力CSVファイルのパス（デフォルト: medical_receipts_data.csv）")
-    parser.add_argument("--batch-size", "-b", type=int, default=10,
-                        help="一度に処理する画像の数（デフォルト: 10）")
+    parser.add_argument("--mode", choices=["live", "batch"], default="live",
+                        help="live: 画像ごとに即時APIを呼び出す / batch: Batch APIで一括処理する（料金半額・最大24時間）（デフォルト: live）")
+    parser.add_argument("--batch-id", action="append", dest="batch_ids",
+                        help="batchモードで中断した処理を再開する場合に、作成済みのバッチジョブのIDを指定する（複数指定可）")
+    parser.add_argument("--max-concurrent", "-c", type=int, default=MAX_CONCURRENT,
+                        help=f"同時に送信するAPIリクエストの最大数（デフォルト: {MAX_CONCURRENT}）")
+    parser.add_argument("--batch-size", "-b", type=int, default=None,
+                        help="（非推奨）--max-concurrent の旧名。指定した値は --max-concurrent として扱う")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE,
+                        help=f"1分あたりに送信するAPIリクエストの最大数（デフォルト: {REQUESTS_PER_MINUTE}）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"キャッシュを使用せずに全画像を再処理する（キャッシュ保存先: {CACHE_DIR}）")
     
     args = parser.parse_args()
-    
-    # バッチサイズを設定
-    global BATCH_SIZE
-    BATCH_SIZE = args.batch_size
+    if args.batch_ids and args.mode != "batch":
+        parser.error("--batch-id は --mode batch と併せて指定してください")
+    if args.batch_size is not None:
+        # 旧バージョンとの互換性のため、--batch-size は --max-concurrent の値として受け付ける
+        print("警告: --batch-size は非推奨です。今後は --max-concurrent を使用してください")
+        args.max_concurrent = args.batch_size
+    if args.max_concurrent < 1:
+        parser.error("--max-concurrent には1以上の整数を指定してください")
+    if args.rpm < 1:
+        parser.error("--rpm には1以上の整数を指定してください")
+
+    # 同時リクエスト数、1分あたりのリクエスト数、キャッシュの使用有無を設定
+    MAX_CONCURRENT = args.max_concurrent
+    REQUESTS_PER_MINUTE = args.rpm
+    USE_CACHE = not args.no_cache
     
     # 処理の実行
-    process_receipts_in_folder(args.folder_path, args.output)
+    asyncio.run(main_async(args))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file